@@ -4,41 +4,108 @@ This file contains common functions for cli tools.
 """
 
 import ast
-import ipaddress
 import json
 import logging
-import re
-from functools import partial, wraps
+import socket
+import sys
+from functools import lru_cache, wraps
 from typing import Any, Callable, ClassVar, Optional, Union
 
 import click
 
-from .exceptions import DeviceError
+from .exceptions import DeviceError, DeviceException
 
 try:
     from rich import print as echo
 except ImportError:
     echo = click.echo
 
+try:
+    import orjson
+
+    def _dumps(obj, pretty=False) -> str:
+        # OPT_NON_STR_KEYS makes orjson coerce non-string dict keys like
+        # the stdlib encoder does
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+        return orjson.dumps(obj, option=option).decode()
+
+except ImportError:
+
+    def _dumps(obj, pretty=False) -> str:
+        return json.dumps(obj, indent=2 if pretty else None)
+
+
 _LOGGER = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=None)
+def _enum_choices(enumcls, casesensitive) -> list[str]:
+    """Return the sorted choice names for the enum, computed once per enum."""
+    choices = enumcls.__members__
+
+    if not casesensitive:
+        choices = (_.lower() for _ in choices)
+
+    return sorted(set(choices))
+
+
+@lru_cache(maxsize=None)
+def _enum_metavar(enumcls) -> str:
+    """Convert the enum class name to an uppercase snake_case metavar."""
+    name = enumcls.__name__
+
+    # Single pass over the name instead of the inflection-style regexes,
+    # inserting an underscore at each camelCase boundary.
+    chars = [name[0].lower()]
+    for i in range(1, len(name)):
+        char = name[i]
+        if char.isupper():
+            prev = name[i - 1]
+            if (
+                prev.islower()
+                or prev.isdigit()
+                or (prev.isupper() and i + 1 < len(name) and name[i + 1].islower())
+            ):
+                chars.append("_")
+        chars.append(char.lower())
+
+    word = "".join(chars).replace("-", "_").split("_")
+
+    if word[-1] == "enum":
+        word.pop()
+
+    return ("_".join(word)).upper()
+
+
 def validate_ip(ctx, param, value):
     if value is None:
         return None
+    # inet_pton is a thin wrapper around libc and avoids constructing
+    # ipaddress objects just for validation.
     try:
-        ipaddress.ip_address(value)
+        socket.inet_pton(socket.AF_INET, value)
         return value
-    except ValueError as ex:
-        raise click.BadParameter("Invalid IP: %s" % ex)
+    except OSError:
+        pass
+    # inet_pton does not understand scoped addresses (fe80::1%eth0),
+    # so validate the address part separately from the zone id
+    addr, sep, zone = value.partition("%")
+    if not sep or zone:
+        try:
+            socket.inet_pton(socket.AF_INET6, addr)
+            return value
+        except OSError:
+            pass
+    raise click.BadParameter(
+        f"Invalid IP: {value!r} does not appear to be an IPv4 or IPv6 address"
+    )
 
 
 def validate_token(ctx, param, value):
     if value is None:
         return None
-    token_len = len(value)
-    if token_len != 32:
-        raise click.BadParameter("Token length != 32 chars: %s" % token_len)
+    if len(value) != 32:
+        raise click.BadParameter(f"Token length != 32 chars: {len(value)}")
     return value
 
 
@@ -53,54 +120,54 @@ class ExceptionHandlerGroup(click.Group):
     def __call__(self, *args, **kwargs):
         try:
             return self.main(*args, **kwargs)
-        except Exception as ex:
-            _LOGGER.exception("Exception: %s", ex)
+        except DeviceException as ex:
+            if _LOGGER.isEnabledFor(logging.ERROR):
+                _LOGGER.exception("Exception: %s", ex)
 
 
 class EnumType(click.Choice):
     def __init__(self, enumcls, casesensitive=False):
-        choices = enumcls.__members__
-
-        if not casesensitive:
-            choices = (_.lower() for _ in choices)
-
         self._enumcls = enumcls
         self._casesensitive = casesensitive
+        self._by_lower = {member.name.lower(): member for member in enumcls}
 
-        super().__init__(list(sorted(set(choices))))
+        super().__init__(_enum_choices(enumcls, casesensitive))
 
     def convert(self, value, param, ctx):
+        # Resolve the member with a hash lookup instead of going through
+        # click.Choice's linear scan over the choices.
         if not self._casesensitive:
-            value = value.lower()
-
-        value = super().convert(value, param, ctx)
-
-        if not self._casesensitive:
-            return next(_ for _ in self._enumcls if _.name.lower() == value.lower())
+            member = self._by_lower.get(value.lower())
         else:
-            return next(_ for _ in self._enumcls if _.name == value)
-
-    def get_metavar(self, param):
-        word = self._enumcls.__name__
+            member = self._enumcls.__members__.get(value)
 
-        # Stolen from jpvanhal/inflection
-        word = re.sub(r"([A-Z]+)([A-Z][a-z])", r"\1_\2", word)
-        word = re.sub(r"([a-z\d])([A-Z])", r"\1_\2", word)
-        word = word.replace("-", "_").lower().split("_")
+        if member is None:
+            self.fail(
+                f"invalid choice: {value}. (choose from {', '.join(self.choices)})",
+                param,
+                ctx,
+            )
 
-        if word[-1] == "enum":
-            word.pop()
+        return member
 
-        return ("_".join(word)).upper()
+    def get_metavar(self, param):
+        return _enum_metavar(self._enumcls)
 
 
 class LiteralParamType(click.ParamType):
     name = "literal"
 
     def convert(self, value, param, ctx):
+        # json.loads is considerably faster than ast.literal_eval for the
+        # inputs both can handle, so try it first and keep literal_eval as a
+        # fallback for python-only literals like tuples and sets.
         try:
-            return ast.literal_eval(value)
+            return json.loads(value)
         except ValueError:
+            pass
+        try:
+            return ast.literal_eval(value)
+        except (ValueError, SyntaxError):
             self.fail("%s is not a valid literal" % value, param, ctx)
 
 
@@ -116,28 +183,24 @@ class DeviceGroupMeta(type):
     _mappings: ClassVar[dict[str, Any]]
 
     def __new__(mcs, name, bases, namespace):
-        commands = {}
-
         def _get_commands_for_namespace(namespace):
             commands = {}
-            for _, val in namespace.items():
+            for val in namespace.values():
                 if not callable(val):
                     continue
                 device_group_command = getattr(val, "_device_group_command", None)
                 if device_group_command is None:
                     continue
-                commands[device_group_command.command_name] = device_group_command
+                # Intern the names to speed up the lookups in get_command
+                name = sys.intern(device_group_command.command_name)
+                commands[name] = device_group_command
 
             return commands
 
-        # 1. Go through base classes for commands
-        for base in bases:
-            commands.update(getattr(base, "_device_group_commands", {}))
-
-        # 2. Add commands from the current class
-        commands.update(_get_commands_for_namespace(namespace))
-
-        namespace["_device_group_commands"] = commands
+        # Store only the commands defined in this class body; the full
+        # command dict is merged lazily on first access to
+        # _device_group_commands below.
+        namespace["_device_group_own_commands"] = _get_commands_for_namespace(namespace)
         if "get_device_group" not in namespace:
 
             def get_device_group(dcls):
@@ -149,6 +212,22 @@ class DeviceGroupMeta(type):
         mcs._device_classes.add(cls)
         return cls
 
+    @property
+    def _device_group_commands(cls) -> dict[str, Any]:
+        """Return all commands for the class, including the inherited ones.
+
+        The merge over the MRO is deferred until the first access and cached,
+        so classes that are never exposed as a CLI group pay nothing at
+        import time.
+        """
+        commands = cls.__dict__.get("_device_group_commands_cache")
+        if commands is None:
+            commands = {}
+            for klass in reversed(cls.__mro__):
+                commands.update(klass.__dict__.get("_device_group_own_commands", {}))
+            cls._device_group_commands_cache = commands
+        return commands
+
     @property
     def supported_models(cls) -> list[str]:
         """Return list of supported models."""
@@ -159,11 +238,11 @@ class DeviceGroup(click.MultiCommand):
     class Command:
         def __init__(self, name, decorators, *, default_output=None, **kwargs):
             self.name = name
-            self.decorators = list(decorators)
-            self.decorators.reverse()
+            self.decorators = tuple(reversed(decorators))
             self.default_output = default_output
 
             self.kwargs = kwargs
+            self._fallback_output = None
 
         def __call__(self, func):
             self.func = func
@@ -171,7 +250,6 @@ class DeviceGroup(click.MultiCommand):
             self.kwargs.setdefault("help", self.func.__doc__)
 
             def _autodetect_model_if_needed(func):
-                @wraps(func)
                 def _wrap(self, *args, **kwargs):
                     skip_autodetect = func._device_group_command.kwargs.pop(
                         "skip_autodetect", False
@@ -185,6 +263,13 @@ class DeviceGroup(click.MultiCommand):
                         self._fetch_info()
                     return func(self, *args, **kwargs)
 
+                # Copy only the attributes we need instead of @wraps, as this
+                # wraps every device command at class-creation time
+                _wrap.__name__ = func.__name__
+                _wrap.__qualname__ = func.__qualname__
+                _wrap.__doc__ = func.__doc__
+                _wrap.__annotations__ = func.__annotations__
+                _wrap.__wrapped__ = func
                 # TODO HACK to make the command visible to cli
                 _wrap._device_group_command = func._device_group_command
                 return _wrap
@@ -197,14 +282,21 @@ class DeviceGroup(click.MultiCommand):
         def command_name(self):
             return self.name or self.func.__name__.lower()
 
-        def wrap(self, ctx, func):
+        def resolve_output(self, ctx):
             gco = ctx.find_object(GlobalContextObject)
             if gco is not None and gco.output is not None:
-                output = gco.output
-            elif self.default_output:
-                output = self.default_output
-            else:
-                output = format_output(f"Running command {self.command_name}")
+                return gco.output
+            if self.default_output:
+                return self.default_output
+            if self._fallback_output is None:
+                self._fallback_output = format_output(
+                    f"Running command {self.command_name}"
+                )
+            return self._fallback_output
+
+        def wrap(self, ctx, func, output=None):
+            if output is None:
+                output = self.resolve_output(ctx)
 
             # Remove skip_autodetect before constructing the click.command
             self.kwargs.pop("skip_autodetect", None)
@@ -245,6 +337,7 @@ class DeviceGroup(click.MultiCommand):
 
         self.device_class = device_class
         self.device_pass = click.make_pass_decorator(device_class)
+        self._command_cache: dict = {}
 
         attrs.setdefault("params", self.DEFAULT_PARAMS)
         attrs.setdefault("callback", click.pass_context(self.group_callback))
@@ -267,17 +360,27 @@ class DeviceGroup(click.MultiCommand):
             kwargs["debug"] = gco.debug
         ctx.obj = self.device_class(*args, **kwargs)
 
-    def command_callback(self, miio_command, miio_device, *args, **kwargs):
-        return miio_command.call(miio_device, *args, **kwargs)
-
     def get_command(self, ctx, cmd_name):
-        if cmd_name not in self.commands:
+        cmd = self.commands.get(cmd_name)
+        if cmd is None:
             ctx.fail("Unknown command (%s)" % cmd_name)
 
-        cmd = self.commands[cmd_name]
-        return self.commands[cmd_name].wrap(
-            ctx, self.device_pass(partial(self.command_callback, cmd))
-        )
+        # Command instances are shared by every class inheriting the command,
+        # so the built click commands are cached per group to keep them bound
+        # to this group's device class. The decorator stack is deterministic
+        # per output, so earlier invocations can be reused.
+        output = cmd.resolve_output(ctx)
+        key = (cmd_name, output)
+        command = self._command_cache.get(key)
+        if command is not None:
+            return command
+
+        def _command_callback(miio_device, *args, **kwargs):
+            return cmd.call(miio_device, *args, **kwargs)
+
+        command = cmd.wrap(ctx, self.device_pass(_command_callback), output)
+        self._command_cache[key] = command
+        return command
 
     def list_commands(self, ctx):
         return sorted(self.commands.keys())
@@ -323,25 +426,19 @@ def format_output(
 
 
 def json_output(pretty=False):
-    indent = 2 if pretty else None
-
     def decorator(func):
         @wraps(func)
         def wrap(*args, **kwargs):
             try:
                 result = func(*args, **kwargs)
             except DeviceError as ex:
-                echo(json.dumps(ex.args[0], indent=indent))
+                echo(_dumps(ex.args[0], pretty))
                 return
 
-            # TODO: __json__ is not used anywhere and could be removed
-            get_json_data_func = getattr(result, "__json__", None)
-            data_variable = getattr(result, "data", None)
-            if get_json_data_func is not None:
-                result = get_json_data_func()
-            elif data_variable is not None:
-                result = data_variable
-            echo(json.dumps(result, indent=indent))
+            data = getattr(result, "data", None)
+            if data is not None:
+                result = data
+            echo(_dumps(result, pretty))
 
         return wrap
 
@@ -1,4 +1,9 @@
-from miio.click_common import validate_ip, validate_token
+import click
+import pytest
+from click.testing import CliRunner
+
+from miio import Device
+from miio.click_common import command, validate_ip, validate_token
 
 
 def test_validate_token_empty():
@@ -7,3 +12,44 @@ def test_validate_token_empty():
 
 def test_validate_ip_empty():
     assert validate_ip(None, None, None) is None
+
+
+@pytest.mark.parametrize("ip", ["192.168.1.1", "fe80::1", "fe80::1%eth0"])
+def test_validate_ip(ip):
+    assert validate_ip(None, None, ip) == ip
+
+
+@pytest.mark.parametrize("ip", ["invalid", "192.168.1", "fe80::1%"])
+def test_validate_ip_invalid(ip):
+    with pytest.raises(click.BadParameter):
+        validate_ip(None, None, ip)
+
+
+def test_inherited_command_binds_to_each_device_group():
+    """The same inherited command must work through multiple device groups."""
+
+    class _Base(Device):
+        @command()
+        def dummy(self):
+            """Dummy command."""
+            return "dummy"
+
+    class _FakeA(_Base):
+        pass
+
+    class _FakeB(_Base):
+        pass
+
+    args = [
+        "--ip",
+        "127.0.0.1",
+        "--token",
+        "0" * 32,
+        "--model",
+        "test.model.v1",
+        "dummy",
+    ]
+    runner = CliRunner()
+    for cls in (_FakeA, _FakeB):
+        result = runner.invoke(cls.get_device_group(), args)
+        assert result.exit_code == 0, result.output